@@ -0,0 +1,64 @@
+"""
+Génère les pages SYNTHÉTIQUES de tests/fixtures/ (youtube_videos.html, youtube_streams.html).
+
+Ce ne sont pas des captures réelles : elles reprennent l'enchaînement d'un onglet de chaîne
+(head, `var ytInitialData = ...;`, scripts de fin de page) et les clés des renderers lues par
+YouTubePageScanner, avec un contenu réduit. À relancer si la structure attendue change :
+
+    python tests/fixtures/make_youtube_fixtures.py
+"""
+import json
+import os
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+
+def video(video_id: str, title: str, live: bool = False, upcoming: bool = False) -> dict:
+    renderer = {
+        "videoId": video_id,
+        "thumbnail": {"thumbnails": [{"url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg", "width": 168, "height": 94}]},
+        "title": {"runs": [{"text": title}]},
+        "descriptionSnippet": {"runs": [{"text": "Description de test, avec accents : é à ü — et des \"guillemets\"."}]},
+        "viewCountText": {"simpleText": "1 234 vues"},
+        "navigationEndpoint": {"commandMetadata": {"webCommandMetadata": {"url": f"/watch?v={video_id}"}}, "watchEndpoint": {"videoId": video_id}},
+        "thumbnailOverlays": [{"thumbnailOverlayTimeStatusRenderer": {"text": {"simpleText": "12:34"}, "style": "DEFAULT"}}],
+    }
+    if live:
+        renderer["badges"] = [{"metadataBadgeRenderer": {"style": "BADGE_STYLE_TYPE_LIVE_NOW", "label": "EN DIRECT"}}]
+        renderer["thumbnailOverlays"] = [{"thumbnailOverlayTimeStatusRenderer": {"text": {"simpleText": "EN DIRECT"}, "style": "LIVE"}}]
+    if upcoming:
+        renderer["upcomingEventData"] = {"startTime": "1791000000", "isReminderSet": False}
+        renderer["thumbnailOverlays"] = [{"thumbnailOverlayTimeStatusRenderer": {"text": {"simpleText": "À VENIR"}, "style": "UPCOMING"}}]
+    return {"richItemRenderer": {"content": {"videoRenderer": renderer}}}
+
+def page(tab: str, items: list, url: str) -> str:
+    data = {
+        "responseContext": {"serviceTrackingParams": [{"service": "GFEEDBACK", "params": [{"key": "browse_id", "value": "UCxxxxxxxxxxxxxxxxxxxxxA"}]}]},
+        "contents": {"twoColumnBrowseResultsRenderer": {"tabs": [
+            {"tabRenderer": {"title": "Accueil", "selected": False}},
+            {"tabRenderer": {"title": tab, "selected": True, "content": {"richGridRenderer": {"contents": items}}}},
+        ]}},
+        "header": {"pageHeaderRenderer": {"pageTitle": "Poxel Test"}},
+    }
+    # Scripts de fin de page remplacés par du remplissage : la lecture doit s'arrêter avant
+    tail = "".join(f'<script nonce="x">var pageScript{i} = "{"x" * 200}";</script>\n' for i in range(40))
+    return ('<!DOCTYPE html>\n<!-- Page SYNTHÉTIQUE (construite à la main, pas une capture réelle) imitant ' + url + ' :\n'
+            '     même enchaînement (head, ytInitialData, scripts de fin de page) et mêmes clés de renderers\n'
+            '     que les pages réelles, contenu réduit et scripts de fin remplacés par du remplissage. -->\n'
+            '<html lang="fr"><head><meta charset="utf-8"><title>Poxel Test - YouTube</title>'
+            '<script nonce="x">var ytcfg = {"INNERTUBE_API_KEY": "test"};</script>'
+            + '<style>' + ".c{color:#000}" * 150 + '</style></head><body>\n'
+            '<script nonce="x">var ytInitialData = ' + json.dumps(data, ensure_ascii=False) + ';</script>\n'
+            + tail + '</body></html>\n')
+
+def write(name: str, content: str):
+    with open(os.path.join(FIXTURES, name), "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+
+if __name__ == "__main__":
+    videos = [video("vid1_aBcD12", "Dernière vidéo : le grand test")] \
+        + [video(f"vid{i}_xYz{i:03d}"[:11], f"Ancienne vidéo {i}") for i in range(2, 31)]
+    # Un live programmé précède le direct : le scanner doit le passer
+    streams = [video("upc1_aBcD12", "Live programmé de vendredi", upcoming=True), video("live_aBcD12", "EN DIRECT : soirée rétro", live=True)] \
+        + [video(f"old{i}_xYz{i:03d}"[:11], f"Rediffusion {i}") for i in range(3, 21)]
+    write("youtube_videos.html", page("Vidéos", videos, "youtube.com/@chaine/videos"))
+    write("youtube_streams.html", page("En direct", streams, "youtube.com/@chaine/streams"))
@@ -0,0 +1,92 @@
+"""
+Analyse incrémentale des pages de chaîne YouTube (YouTubePageScanner) sur des pages synthétiques
+(tests/fixtures/, générées par make_youtube_fixtures.py) : élément retenu, arrêt anticipé
+(la fin de la page n'est pas lue) et mémoire bornée.
+
+    python -m pytest tests/test_youtube_scanner.py
+"""
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from youtube_scanner import YouTubePageScanner
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+CHUNK_SIZE = 1024 # Taille des morceaux, comme une lecture réseau
+MAX_BYTES_READ = 8 * 1024 # L'élément utile est au début de ytInitialData : la lecture s'arrête avant
+MAX_PEAK_MEMORY = 64 * 1024 # Mémoire allouée au pic pendant l'analyse d'une page
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+def scan(page: bytes, category: str):
+    """Donne la page morceau par morceau ; retourne (scanner, octets lus avant l'arrêt, pic mémoire)."""
+    scanner = YouTubePageScanner(category)
+    consumed = 0
+    tracemalloc.start()
+    try:
+        for i in range(0, len(page), CHUNK_SIZE):
+            chunk = page[i:i + CHUNK_SIZE]
+            consumed += len(chunk)
+            if scanner.feed(chunk):
+                break
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return scanner, consumed, peak
+
+def test_videos_first_item_and_early_stop():
+    page = read_fixture("youtube_videos.html")
+    scanner, consumed, peak = scan(page, "video")
+    assert scanner.found_data and scanner.done
+    assert scanner.item == {"id": "vid1_aBcD12", "title": "Dernière vidéo : le grand test"}
+    assert consumed <= MAX_BYTES_READ < len(page)
+    assert peak < MAX_PEAK_MEMORY
+
+def test_streams_skips_scheduled_live():
+    page = read_fixture("youtube_streams.html")
+    scanner, consumed, peak = scan(page, "live")
+    assert scanner.done
+    assert scanner.item == {"id": "live_aBcD12", "title": "EN DIRECT : soirée rétro"}
+    assert consumed <= MAX_BYTES_READ < len(page)
+    assert peak < MAX_PEAK_MEMORY
+
+def test_videos_tab_as_live_is_offline():
+    # Premier élément ni en direct ni programmé : hors ligne, sans lire la suite
+    page = read_fixture("youtube_videos.html")
+    scanner, consumed, _ = scan(page, "live")
+    assert scanner.done and scanner.item is None
+    assert consumed <= MAX_BYTES_READ
+
+def test_full_scan_keeps_buffer_bounded():
+    # Aucun Short sur l'onglet /videos : tout ytInitialData est parcouru, mais seul un petit
+    # reste est gardé entre deux morceaux (la page entière n'est jamais en mémoire)
+    page = read_fixture("youtube_videos.html")
+    scanner = YouTubePageScanner("short")
+    largest = 0
+    tracemalloc.start()
+    try:
+        for i in range(0, len(page), CHUNK_SIZE):
+            done = scanner.feed(page[i:i + CHUNK_SIZE])
+            largest = max(largest, len(scanner._text))
+            if done:
+                break
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert scanner.done and scanner.item is None
+    assert largest <= CHUNK_SIZE + 64
+    assert peak < MAX_PEAK_MEMORY
+
+def test_split_marker_and_utf8():
+    # Morceaux d'un octet : repère ytInitialData et caractères UTF-8 coupés entre deux morceaux
+    scanner = YouTubePageScanner("video")
+    page = read_fixture("youtube_videos.html")
+    for i in range(len(page)):
+        if scanner.feed(page[i:i + 1]):
+            break
+    assert scanner.item["id"] == "vid1_aBcD12"
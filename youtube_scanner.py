@@ -0,0 +1,97 @@
+"""
+Analyse incrémentale des onglets de chaîne YouTube (/streams, /videos, /shorts) pour Poxel.
+
+La page d'une chaîne pèse plusieurs centaines de Ko, mais seul le début de ytInitialData est utile.
+YouTubePageScanner lit la réponse morceau par morceau : il ignore tout jusqu'à ytInitialData,
+puis décode isolément chaque élément (videoRenderer, reelItemRenderer...) dès qu'il est complet,
+et la lecture s'arrête au premier élément concluant.
+Module séparé (sans dépendance à discord.py) pour pouvoir être testé seul.
+"""
+import codecs
+import json
+import re
+from typing import Optional, Dict, Any
+
+_YT_INITIAL_DATA = re.compile(r'(?:var ytInitialData|window\["ytInitialData"\])\s*=\s*')
+
+def _yt_text(node: Optional[Dict]) -> Optional[str]:
+    """Texte d'un nœud YouTube ({"simpleText": ...} ou {"runs": [{"text": ...}]})."""
+    if not isinstance(node, dict): return None
+    if "simpleText" in node: return node["simpleText"]
+    runs = node.get("runs") or []
+    return "".join(run.get("text", "") for run in runs) or None
+
+class YouTubePageScanner:
+    """
+    Analyse incrémentale d'un onglet de chaîne YouTube (/streams, /videos ou /shorts).
+    feed() retourne True dès que la suite de la page n'est plus nécessaire ; `item` contient
+    alors {"id", "title"} de l'élément trouvé (None si aucun : hors ligne pour les lives).
+    """
+    RENDERER_PATTERNS = {
+        "live": re.compile(r'"(videoRenderer)"\s*:\s*(?=\{)'),
+        "video": re.compile(r'"(videoRenderer)"\s*:\s*(?=\{)'),
+        "short": re.compile(r'"(reelItemRenderer|shortsLockupViewModel)"\s*:\s*(?=\{)'),
+    }
+    MAX_LIVE_CANDIDATES = 3 # Lives programmés examinés avant de conclure "hors ligne"
+
+    def __init__(self, category: str):
+        self.category = category
+        self.pattern = self.RENDERER_PATTERNS.get(category, self.RENDERER_PATTERNS["video"])
+        self.item: Optional[Dict[str, Any]] = None
+        self.found_data = False # ytInitialData rencontré
+        self.done = False
+        self._text = ""
+        self._utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._json = json.JSONDecoder()
+        self._candidates = 0
+
+    def feed(self, chunk: bytes) -> bool:
+        self._text += self._utf8.decode(chunk)
+        if not self.found_data:
+            match = _YT_INITIAL_DATA.search(self._text)
+            if not match:
+                self._text = self._text[-64:] # Le repère peut être coupé entre deux morceaux
+                return False
+            self.found_data = True
+            self._text = self._text[match.end():]
+        while not self.done:
+            match = self.pattern.search(self._text)
+            end_of_data = self._text.find("</script>")
+            if not match or (0 <= end_of_data < match.start()):
+                if end_of_data >= 0:
+                    self.done = True # Fin de ytInitialData sans (autre) élément
+                else:
+                    self._text = self._text[-64:]
+                break
+            try:
+                renderer, end = self._json.raw_decode(self._text, match.end())
+            except ValueError:
+                self._text = self._text[match.start():] # Élément incomplet : on attend la suite
+                break
+            self._text = self._text[end:]
+            self._consider(match.group(1), renderer)
+        return self.done
+
+    def _consider(self, kind: str, renderer: Dict):
+        if kind == "shortsLockupViewModel":
+            endpoint = renderer.get("onTap", {}).get("innertubeCommand", {}).get("reelWatchEndpoint", {})
+            video_id = endpoint.get("videoId")
+            title = renderer.get("overlayMetadata", {}).get("primaryText", {}).get("content")
+        else:
+            video_id = renderer.get("videoId")
+            title = _yt_text(renderer.get("headline") if kind == "reelItemRenderer" else renderer.get("title"))
+        if not video_id: return
+
+        if self.category == "live":
+            overlays = renderer.get("thumbnailOverlays", [])
+            badges = renderer.get("badges", [])
+            is_live = any(o.get("thumbnailOverlayTimeStatusRenderer", {}).get("style") == "LIVE" for o in overlays) \
+                or any(b.get("metadataBadgeRenderer", {}).get("style") == "BADGE_STYLE_TYPE_LIVE_NOW" for b in badges)
+            if not is_live:
+                self._candidates += 1
+                # Un live programmé peut précéder le direct ; une rediffusion signifie "hors ligne"
+                if "upcomingEventData" in renderer and self._candidates < self.MAX_LIVE_CANDIDATES: return
+                self.done = True
+                return
+        self.item = {"id": video_id, "title": title}
+        self.done = True